@@ -3,16 +3,19 @@ os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'  # Allow HTTP for local dev
 
 from flask import Flask, render_template, redirect, url_for, session, request, send_from_directory
 from google_auth_oauthlib.flow import Flow
-from googleapiclient.discovery import build
 import google.oauth2.credentials
+import google.auth.transport.requests
+import aiohttp
 import re
-from main import get_subscriptions_data, load_users_from_csv, build_network_graph, create_network_visualization
+import asyncio
+from main import get_subscriptions_data_async, load_users_from_csv, build_network_graph, create_network_visualization
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-prod')
 
 CLIENT_SECRETS_FILE = "client_secret.json"
 SCOPES = ['https://www.googleapis.com/auth/youtube.readonly']
+_SAFE_USERNAME_RE = re.compile(r'[^\w\s-]')
 
 os.makedirs('users', exist_ok=True)
 os.makedirs('static', exist_ok=True)
@@ -89,11 +92,20 @@ def fetch_subscriptions():
         return redirect(url_for('login'))
     
     credentials = google.oauth2.credentials.Credentials(**session['credentials'])
-    youtube = build('youtube', 'v3', credentials=credentials)
     
-    df = get_subscriptions_data(youtube)
+    try:
+        df = asyncio.run(get_subscriptions_data_async(credentials.token))
+    except aiohttp.ClientResponseError as e:
+        if e.status != 401:
+            raise
+        # Access token expired; googleapiclient used to refresh it for us
+        if not credentials.refresh_token:
+            return redirect(url_for('login'))
+        credentials.refresh(google.auth.transport.requests.Request())
+        session['credentials'] = credentials_to_dict(credentials)
+        df = asyncio.run(get_subscriptions_data_async(credentials.token))
     
-    safe_username = re.sub(r'[^\w\s-]', '', session['username']).strip().replace(' ', '_')
+    safe_username = _SAFE_USERNAME_RE.sub('', session['username']).strip().replace(' ', '_')
     df.to_csv(f'users/{safe_username}.csv', index=False)
     
     return redirect(url_for('visualize'))
@@ -112,7 +124,8 @@ def visualize():
         usernames = [person.name for person in personlist]
         
         nxgraph = build_network_graph(personlist, channellist)
-        create_network_visualization(nxgraph)  # Remove usernames parameter for now
+        # Write where the /graph route reads from, independent of the cwd
+        create_network_visualization(nxgraph, output_path=os.path.join(app.static_folder, 'graph.html'))
         
         return render_template('visualize.html')
     
@@ -123,9 +136,16 @@ def visualize():
         return render_template('error.html', message=f"{str(e)}<br><br><pre>{error_details}</pre>")
 
 
-@app.route('/static/<path:filename>')
-def serve_static(filename):
-    return send_from_directory('static', filename)
+@app.route('/graph')
+def graph():
+    # Serve the gzip copy written by create_network_visualization when the client accepts it
+    if request.accept_encodings['gzip'] > 0 and os.path.exists(os.path.join(app.static_folder, 'graph.html.gz')):
+        response = send_from_directory(app.static_folder, 'graph.html.gz', mimetype='text/html')
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = send_from_directory(app.static_folder, 'graph.html')
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
 
 
 if __name__ == '__main__':
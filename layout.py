@@ -0,0 +1,390 @@
+"""
+Server-side force-directed layout
+Computes fixed node positions so the browser only has to render the graph
+"""
+
+import os
+import numpy as np
+from numba import njit, prange
+from scipy.optimize import minimize
+
+try:
+    import cudf
+    import cugraph
+except ImportError:
+    cugraph = None
+
+LAYOUT_BACKEND = os.environ.get('LAYOUT_BACKEND', 'cpu')  # 'gpu' uses cuGraph when available
+
+SPRING_LENGTH = 200     # Target edge length in vis-network pixels
+MAX_DEPTH = 32          # Quadtree depth limit, guards against coincident nodes
+THETA = 0.8             # Barnes-Hut opening angle
+LBFGS_MAX_NODES = 1000  # Above this, exact O(n^2) repulsion costs more than Barnes-Hut
+GRAVITY = 0.01          # Pull toward the origin, keeps disconnected parts in view
+REPULSION_BLOCK = 512   # Rows per block when broadcasting pairwise repulsion
+COARSEST_NODES = 100    # Stop coarsening once a level is this small
+REFINE_ITERS = 30       # Solver iterations per intermediate level when projecting back up
+FINEST_ITERS = 200      # The finest level gets a full solve to separate sibling nodes
+
+
+def graph_to_csr(nxgraph):
+    """Return node list plus symmetric CSR adjacency (indptr, indices)"""
+    nodes = list(nxgraph.nodes())
+    index = {node: i for i, node in enumerate(nodes)}
+
+    edges = np.array([(index[u], index[v]) for u, v in nxgraph.edges() if u != v],
+                     dtype=np.int32).reshape(-1, 2)
+    src = np.concatenate([edges[:, 0], edges[:, 1]])
+    dst = np.concatenate([edges[:, 1], edges[:, 0]])
+
+    order = np.argsort(src, kind='stable')
+    indices = dst[order]
+    indptr = np.zeros(len(nodes) + 1, dtype=np.int32)
+    np.cumsum(np.bincount(src, minlength=len(nodes)), out=indptr[1:])
+    return nodes, indptr, indices
+
+
+@njit(cache=True)
+def _build_quadtree(pos):
+    """Build a quadtree over pos; every cell tracks its mass and center of mass"""
+    n = pos.shape[0]
+    capacity = 16 * n + 64
+    children = np.full((capacity, 4), -1, dtype=np.int32)
+    body = np.full(capacity, -1, dtype=np.int32)  # -1 empty leaf, -2 internal
+    mass = np.zeros(capacity, dtype=np.float32)
+    com = np.zeros((capacity, 2), dtype=np.float32)
+    center = np.zeros((capacity, 2), dtype=np.float32)
+    half = np.zeros(capacity, dtype=np.float32)
+    depth = np.zeros(capacity, dtype=np.int32)
+
+    lo_x, hi_x = pos[:, 0].min(), pos[:, 0].max()
+    lo_y, hi_y = pos[:, 1].min(), pos[:, 1].max()
+    center[0, 0] = (lo_x + hi_x) / 2
+    center[0, 1] = (lo_y + hi_y) / 2
+    half[0] = max(hi_x - lo_x, hi_y - lo_y) / 2 + 1e-6
+    used = 1
+
+    for i in range(n):
+        c = 0
+        while True:
+            mass[c] += 1
+            com[c] += pos[i]
+
+            if body[c] == -1 and children[c, 0] == -1:
+                body[c] = i
+                break
+
+            if body[c] >= 0:
+                # Occupied leaf: split it, unless out of depth or space, in
+                # which case both bodies share the leaf
+                if depth[c] >= MAX_DEPTH or used + 4 > capacity:
+                    break
+                for q in range(4):
+                    child = used + q
+                    children[c, q] = child
+                    half[child] = half[c] / 2
+                    depth[child] = depth[c] + 1
+                    center[child, 0] = center[c, 0] + (half[c] / 2 if q & 1 else -half[c] / 2)
+                    center[child, 1] = center[c, 1] + (half[c] / 2 if q & 2 else -half[c] / 2)
+                used += 4
+
+                j = body[c]
+                q = int(pos[j, 0] > center[c, 0]) | (int(pos[j, 1] > center[c, 1]) << 1)
+                child = children[c, q]
+                body[child] = j
+                mass[child] = 1
+                com[child] = pos[j]
+                body[c] = -2
+
+            q = int(pos[i, 0] > center[c, 0]) | (int(pos[i, 1] > center[c, 1]) << 1)
+            c = children[c, q]
+
+    for c in range(used):
+        if mass[c] > 0:
+            com[c] /= mass[c]
+    return children[:used], body[:used], mass[:used], com[:used], half[:used]
+
+
+@njit(parallel=True, fastmath=True, cache=True)
+def _repulsive_bh(children, body, mass, com, half, pos, forces, k):
+    """Fruchterman-Reingold repulsion k^2/d, approximated with Barnes-Hut"""
+    n = pos.shape[0]
+    k2 = k * k
+    for i in prange(n):
+        stack = np.empty(4 * MAX_DEPTH + 4, dtype=np.int32)
+        stack[0] = 0
+        top = 1
+        fx = 0.0
+        fy = 0.0
+        while top > 0:
+            top -= 1
+            c = stack[top]
+            if mass[c] == 0 or body[c] == i:
+                continue
+
+            dx = pos[i, 0] - com[c, 0]
+            dy = pos[i, 1] - com[c, 1]
+            d2 = dx * dx + dy * dy
+            if d2 < 1e-12:
+                continue
+            d = np.sqrt(d2)
+
+            if body[c] >= 0 or 2 * half[c] / d < THETA:
+                f = mass[c] * k2 / d2
+                fx += dx * f
+                fy += dy * f
+            else:
+                for q in range(4):
+                    if children[c, q] >= 0:
+                        stack[top] = children[c, q]
+                        top += 1
+        forces[i, 0] = fx
+        forces[i, 1] = fy
+
+
+@njit(parallel=True, fastmath=True, cache=True)
+def _attractive(indptr, indices, pos, forces, k):
+    """Fruchterman-Reingold attraction d^2/k along each edge"""
+    n = pos.shape[0]
+    for i in prange(n):
+        for e in range(indptr[i], indptr[i + 1]):
+            j = indices[e]
+            dx = pos[i, 0] - pos[j, 0]
+            dy = pos[i, 1] - pos[j, 1]
+            d = np.sqrt(dx * dx + dy * dy)
+            forces[i, 0] -= dx * d / k
+            forces[i, 1] -= dy * d / k
+
+
+@njit(fastmath=True, cache=True)
+def _displace(pos, forces, temperature):
+    """Move each node along its force, capped at the current temperature"""
+    for i in range(pos.shape[0]):
+        fx = forces[i, 0]
+        fy = forces[i, 1]
+        length = np.sqrt(fx * fx + fy * fy)
+        if length > 0:
+            step = min(length, temperature) / length
+            pos[i, 0] += fx * step
+            pos[i, 1] += fy * step
+
+
+def fruchterman_reingold(indptr, indices, pos, iterations=300, t0=0.1):
+    """Run Barnes-Hut Fruchterman-Reingold on pos in place, with linear cooling"""
+    n = pos.shape[0]
+    k = np.float32(1 / np.sqrt(n))
+    forces = np.zeros_like(pos)
+    for step in range(iterations):
+        _repulsive_bh(*_build_quadtree(pos), pos, forces, k)
+        _attractive(indptr, indices, pos, forces, k)
+        _displace(pos, forces, t0 * (1 - step / iterations))
+    return pos
+
+
+def _fr_energy_and_grad(x, indptr, indices, k):
+    """Fruchterman-Reingold energy and its gradient for flattened positions x
+
+    Attraction sum(d^3 / 3k) runs over CSR edges, repulsion -k^2 sum(ln d)
+    over all pairs in row blocks so memory stays O(block * n).
+    """
+    pos = x.reshape(-1, 2)
+    n = pos.shape[0]
+    grad = np.zeros_like(pos)
+
+    src = np.repeat(np.arange(n), np.diff(indptr))
+    delta = pos[src] - pos[indices]
+    dist = np.sqrt((delta ** 2).sum(axis=1))
+    # Each edge appears once per direction in the CSR arrays
+    energy = (dist ** 3).sum() / (6 * k)
+    np.add.at(grad, src, delta * (dist / k)[:, None])
+
+    k2 = k * k
+    px, py = pos[:, 0], pos[:, 1]
+    for start in range(0, n, REPULSION_BLOCK):
+        stop = min(start + REPULSION_BLOCK, n)
+        dx = px[start:stop, None] - px[None, :]
+        dy = py[start:stop, None] - py[None, :]
+        d2 = dx * dx + dy * dy
+        rows = np.arange(stop - start)
+        d2[rows, rows + start] = 1.0  # Self pairs contribute ln(1) = 0 and no force
+        np.maximum(d2, 1e-12, out=d2)
+        inv = 1.0 / d2
+        inv[rows, rows + start] = 0.0
+        energy -= k2 * 0.25 * np.log(d2).sum()  # Halved for double-counted pairs
+        grad[start:stop, 0] -= k2 * (dx * inv).sum(axis=1)
+        grad[start:stop, 1] -= k2 * (dy * inv).sum(axis=1)
+
+    energy += 0.5 * GRAVITY * (pos ** 2).sum()
+    grad += GRAVITY * pos
+    return energy, grad.ravel()
+
+
+def fr_lbfgs(indptr, indices, pos, maxiter=200):
+    """Minimize Fruchterman-Reingold energy with L-BFGS, starting from pos"""
+    k = 1 / np.sqrt(pos.shape[0])
+    result = minimize(
+        _fr_energy_and_grad,
+        pos.ravel(),
+        args=(indptr, indices, k),
+        jac=True,
+        method='L-BFGS-B',
+        options={'maxiter': maxiter}
+    )
+    return result.x.reshape(-1, 2)
+
+
+def coarsen(indptr, indices, weights, rng):
+    """Contract a heavy-edge matching; returns coarse CSR, weights and fine->coarse map
+
+    Nodes left unmatched are then paired with another unmatched node sharing
+    their heaviest neighbor, so star-like hubs (users) still shrink per level.
+    """
+    n = len(indptr) - 1
+    mate = np.full(n, -1, dtype=np.int64)
+    order = rng.permutation(n)
+
+    for u in order:
+        if mate[u] != -1:
+            continue
+        start, stop = indptr[u], indptr[u + 1]
+        best, best_weight = -1, 0.0
+        for e in range(start, stop):
+            v = indices[e]
+            if v != u and mate[v] == -1 and weights[e] > best_weight:
+                best, best_weight = v, weights[e]
+        if best != -1:
+            mate[u], mate[best] = best, u
+
+    pending = np.full(n, -1, dtype=np.int64)
+    for u in order:
+        if mate[u] != -1 or indptr[u] == indptr[u + 1]:
+            continue
+        start, stop = indptr[u], indptr[u + 1]
+        hub = indices[start + np.argmax(weights[start:stop])]
+        v = pending[hub]
+        if v != -1 and mate[v] == -1:
+            mate[u], mate[v] = v, u
+            pending[hub] = -1
+        else:
+            pending[hub] = u
+
+    # Each matched pair (and each singleton) becomes one coarse node
+    leader = np.where(mate == -1, np.arange(n), np.minimum(np.arange(n), mate))
+    _, mapping = np.unique(leader, return_inverse=True)
+    n_coarse = mapping.max() + 1
+
+    src = mapping[np.repeat(np.arange(n), np.diff(indptr))]
+    dst = mapping[indices]
+    keep = src != dst
+    keys = src[keep] * n_coarse + dst[keep]
+    keys, inverse = np.unique(keys, return_inverse=True)
+    coarse_weights = np.bincount(inverse, weights=weights[keep])
+
+    coarse_src, coarse_indices = np.divmod(keys, n_coarse)
+    coarse_indptr = np.zeros(n_coarse + 1, dtype=np.int64)
+    np.cumsum(np.bincount(coarse_src, minlength=n_coarse), out=coarse_indptr[1:])
+    return coarse_indptr, coarse_indices, coarse_weights, mapping
+
+
+def _solve_level(indptr, indices, pos, iterations, t0):
+    """Run L-BFGS on small levels and Barnes-Hut FR on large ones"""
+    if pos.shape[0] <= LBFGS_MAX_NODES:
+        return fr_lbfgs(indptr, indices, pos.astype(np.float64), iterations)
+    pos = pos.astype(np.float32)
+    fruchterman_reingold(indptr, indices, pos, iterations, t0)
+    return pos
+
+
+def multilevel_positions(indptr, indices, rng):
+    """Coarsen until COARSEST_NODES, lay out the coarsest level, then refine back up
+
+    Graphs small enough for L-BFGS are solved directly without coarsening.
+    """
+    levels = []
+    weights = np.ones(len(indices))
+    coarsen_above = COARSEST_NODES if len(indptr) - 1 > LBFGS_MAX_NODES else len(indptr) - 1
+    while len(indptr) - 1 > coarsen_above:
+        coarse = coarsen(indptr, indices, weights, rng)
+        if len(coarse[0]) - 1 > 0.9 * (len(indptr) - 1):
+            break  # Matching has stalled, further levels would barely shrink
+        levels.append((indptr, indices, coarse[3]))
+        indptr, indices, weights = coarse[:3]
+
+    pos = _solve_level(indptr, indices, rng.standard_normal((len(indptr) - 1, 2)), 200, 0.1)
+
+    for depth, (indptr, indices, mapping) in reversed(list(enumerate(levels))):
+        k = 1 / np.sqrt(len(mapping))
+        pos = pos[mapping] + rng.normal(scale=0.1 * k, size=(len(mapping), 2))
+        iterations = FINEST_ITERS if depth == 0 else REFINE_ITERS
+        pos = _solve_level(indptr, indices, pos, iterations, 2 * k)
+    return pos
+
+
+def scale_to_spring_length(pos, indptr, indices):
+    """Center pos and scale it so the median edge is SPRING_LENGTH pixels long"""
+    pos = pos - pos.mean(axis=0)
+    src = np.repeat(np.arange(len(pos)), np.diff(indptr))
+    lengths = np.linalg.norm(pos[src] - pos[indices], axis=1)
+    if lengths.size and np.median(lengths) > 0:
+        pos = pos * (SPRING_LENGTH / np.median(lengths))
+    return pos
+
+
+def apply_positions(nxgraph, nodes, pos):
+    """Write fixed x/y coords to the graph and take the nodes out of physics"""
+    for node, (x, y) in zip(nodes, pos.tolist()):
+        attrs = nxgraph.nodes[node]
+        attrs['x'] = x
+        attrs['y'] = y
+        attrs['physics'] = False
+
+
+def multilevel_layout(nxgraph, seed=0):
+    """Lay out nxgraph on progressively coarser graphs and fix each node's x/y"""
+    nodes, indptr, indices = graph_to_csr(nxgraph)
+    rng = np.random.default_rng(seed)
+
+    pos = multilevel_positions(indptr, indices, rng)
+    apply_positions(nxgraph, nodes, scale_to_spring_length(pos, indptr, indices))
+    return nxgraph
+
+
+def layout_force_atlas2(nxgraph, max_iter=500, seed=0):
+    """Lay out nxgraph with cuGraph's GPU ForceAtlas2 and fix each node's x/y"""
+    nodes, indptr, indices = graph_to_csr(nxgraph)
+    src = np.repeat(np.arange(len(nodes), dtype=np.int32), np.diff(indptr))
+    once = src < indices
+
+    G = cugraph.Graph()
+    G.from_cudf_edgelist(
+        cudf.DataFrame({'src': src[once], 'dst': indices[once]}),
+        source='src',
+        destination='dst'
+    )
+    pos_df = cugraph.force_atlas2(
+        G,
+        max_iter=max_iter,
+        barnes_hut_optimize=True,
+        scaling_ratio=2.0,
+        gravity=1.0
+    ).to_pandas()
+
+    # Isolated nodes are not part of the edge list, leave them near the origin
+    rng = np.random.default_rng(seed)
+    pos = rng.standard_normal((len(nodes), 2))
+    pos[pos_df['vertex'].to_numpy()] = pos_df[['x', 'y']].to_numpy()
+
+    apply_positions(nxgraph, nodes, scale_to_spring_length(pos, indptr, indices))
+    return nxgraph
+
+
+def compute_layout(nxgraph, backend=LAYOUT_BACKEND):
+    """Lay out nxgraph server-side with the GPU backend or the CPU multilevel solver"""
+    n = nxgraph.number_of_nodes()
+    if n == 0:
+        return nxgraph
+    if backend == 'gpu':
+        if cugraph is not None:
+            return layout_force_atlas2(nxgraph)
+        print("Warning: cugraph not available, falling back to CPU layout")
+    return multilevel_layout(nxgraph)
@@ -5,20 +5,54 @@ Fetches user subscriptions and creates an interactive network graph
 
 import os
 import re
+import gzip
+import json
+import shutil
+import time
 import pickle
+import sqlite3
+import asyncio
+import aiohttp
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import pandas as pd
 import networkx as nx
 from pyvis.network import Network
 from randomcolor import RandomColor
+from layout import compute_layout
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
 # Config
 SCOPES = ['https://www.googleapis.com/auth/youtube.readonly']
+YOUTUBE_API_URL = 'https://www.googleapis.com/youtube/v3'
 DISPLAY_DEGREE_ONE = False  # Show channels with only 1 subscriber
 DATA_DIR = 'users'
 STATIC_DIR = 'static'
 CREDENTIALS_FILE = 'client_secret.json'
+CHANNEL_CACHE_FILE = os.path.join(DATA_DIR, '_channel_cache.sqlite3')
+CHANNEL_CACHE_TTL = 30 * 24 * 60 * 60  # Refetch channel details after 30 days
+
+# User CSV layout; subscribers_numeric is left to type inference since it
+# holds NaN for hidden counts
+CSV_COLUMNS = ['channel_id', 'channel_title', 'subscribers_numeric', 'thumbnail', 'category']
+CSV_DTYPES = {
+    'channel_id': 'string',
+    'channel_title': 'string',
+    'category': 'category',
+    'thumbnail': 'string'
+}
+
+_SAFE_USERNAME_RE = re.compile(r'[^\w\s-]')
+
+# Parsed user CSVs keyed by path, invalidated when the file's mtime changes
+_CSV_CACHE = {}
 
 
 def authenticate_youtube():
@@ -47,10 +81,85 @@ def authenticate_youtube():
     return build('youtube', 'v3', credentials=creds)
 
 
+def load_channel_cache(path=CHANNEL_CACHE_FILE, ttl=CHANNEL_CACHE_TTL):
+    """Load cached channels.list items that are younger than ttl seconds"""
+    if not os.path.exists(path):
+        return {}
+
+    cutoff = time.time() - ttl
+    with closing(sqlite3.connect(path)) as conn, conn:
+        rows = conn.execute(
+            'SELECT channel_id, data FROM channels WHERE fetched_at >= ?', (cutoff,)
+        ).fetchall()
+    return {channel_id: json.loads(data) for channel_id, data in rows}
+
+
+def save_channel_cache(channels, path=CHANNEL_CACHE_FILE):
+    """Insert or refresh channels.list items in the on-disk cache"""
+    if not channels:
+        return
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    now = time.time()
+    with closing(sqlite3.connect(path)) as conn, conn:
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS channels '
+            '(channel_id TEXT PRIMARY KEY, data TEXT NOT NULL, fetched_at REAL NOT NULL)'
+        )
+        conn.executemany(
+            'INSERT OR REPLACE INTO channels VALUES (?, ?, ?)',
+            [(channel_id, json.dumps(info), now) for channel_id, info in channels.items()]
+        )
+
+
+def uncached_channel_ids(items, channel_cache):
+    """Channel ids on a subscriptions page that still need a channels.list call"""
+    page_ids = [item['snippet']['resourceId']['channelId'] for item in items]
+    return [channel_id for channel_id in page_ids if channel_id not in channel_cache]
+
+
+def cache_channels(channel_response, channel_cache, fetched):
+    """Merge a channels.list response into the cache and the to-be-saved set"""
+    for ci in channel_response.get('items', []):
+        fetched[ci['id']] = channel_cache[ci['id']] = ci
+
+
+def build_channel_stats(items, by_id):
+    """Join subscription items with their channels.list details"""
+    stats = []
+    for item in items:
+        snip = item['snippet']
+        channel_id = snip['resourceId']['channelId']
+
+        channel_info = by_id.get(channel_id)
+        if channel_info:
+            s = channel_info['statistics']
+            snippet = channel_info['snippet']
+
+            # Extract category from topic details if available
+            category = snippet.get('customUrl', '')
+            if 'topicDetails' in channel_info and 'topicCategories' in channel_info['topicDetails']:
+                topics = channel_info['topicDetails']['topicCategories']
+                category = ', '.join([t.split('/')[-1].replace('_', ' ') for t in topics])
+
+            # subscriberCount is missing when the channel hides it
+            subs = s.get('subscriberCount')
+            stats.append({
+                'channel_id': channel_id,
+                'channel_title': snip['title'],
+                'subscribers_numeric': int(subs) if subs and subs.isdigit() else None,
+                'thumbnail': snip['thumbnails']['default']['url'],
+                'category': category
+            })
+    return stats
+
+
 def get_subscriptions_data(youtube):
     """Fetch all subscriptions with pagination"""
     stats = []
     next_page_token = None
+    channel_cache = load_channel_cache()
+    fetched = {}
 
     while True:
         response = youtube.subscriptions().list(
@@ -60,47 +169,87 @@ def get_subscriptions_data(youtube):
             pageToken=next_page_token
         ).execute()
 
-        for item in response['items']:
-            snip = item['snippet']
-            channel_id = snip['resourceId']['channelId']
+        items = response['items']
 
-            # Get detailed channel info
+        # Get detailed channel info for the uncached part of the page in one call
+        missing_ids = uncached_channel_ids(items, channel_cache)
+        if missing_ids:
             channel_response = youtube.channels().list(
                 part='statistics,snippet,topicDetails',
-                id=channel_id
+                id=','.join(missing_ids),
+                maxResults=50
             ).execute()
+            cache_channels(channel_response, channel_cache, fetched)
 
-            if channel_response['items']:
-                channel_info = channel_response['items'][0]
-                s = channel_info['statistics']
-                snippet = channel_info['snippet']
-
-                # Extract category from topic details if available
-                category = snippet.get('customUrl', '')
-                if 'topicDetails' in channel_info and 'topicCategories' in channel_info['topicDetails']:
-                    topics = channel_info['topicDetails']['topicCategories']
-                    category = ', '.join([t.split('/')[-1].replace('_', ' ') for t in topics])
-
-                stats.append({
-                    'channel_id': channel_id,
-                    'channel_title': snip['title'],
-                    'subscribers': s.get('subscriberCount', 'Hidden'),
-                    'thumbnail': snip['thumbnails']['default']['url'],
-                    'category': category
-                })
+        stats.extend(build_channel_stats(items, channel_cache))
 
         next_page_token = response.get('nextPageToken')
         if not next_page_token:
             break
 
-    df = pd.DataFrame(stats)
-    df['subscribers_numeric'] = pd.to_numeric(df['subscribers'], errors='coerce')
-    return df
+    save_channel_cache(fetched)
+    return pd.DataFrame(stats, columns=CSV_COLUMNS)
+
+
+async def _fetch_json(session, url, params):
+    async with session.get(url, params=params) as resp:
+        resp.raise_for_status()
+        return await resp.json()
+
+
+async def _fetch_channel_stats(session, items, channel_cache, fetched):
+    """Fetch uncached channel details for one subscriptions page"""
+    missing_ids = uncached_channel_ids(items, channel_cache)
+    if missing_ids:
+        channel_response = await _fetch_json(session, f'{YOUTUBE_API_URL}/channels', {
+            'part': 'statistics,snippet,topicDetails',
+            'id': ','.join(missing_ids),
+            'maxResults': 50
+        })
+        cache_channels(channel_response, channel_cache, fetched)
+
+    return build_channel_stats(items, channel_cache)
+
+
+async def get_subscriptions_data_async(access_token):
+    """Fetch all subscriptions, overlapping channel lookups with paging.
+
+    Page tokens are opaque, so subscription pages are walked in order while
+    each page's channels.list batch runs as its own task.
+    """
+    headers = {'Authorization': f'Bearer {access_token}'}
+    tasks = []
+    next_page_token = None
+    channel_cache = load_channel_cache()
+    fetched = {}
+
+    async with aiohttp.ClientSession(headers=headers) as session:
+        while True:
+            params = {'part': 'snippet', 'mine': 'true', 'maxResults': 50}
+            if next_page_token:
+                params['pageToken'] = next_page_token
+
+            response = await _fetch_json(session, f'{YOUTUBE_API_URL}/subscriptions', params)
+            tasks.append(asyncio.create_task(
+                _fetch_channel_stats(session, response['items'], channel_cache, fetched)
+            ))
+
+            next_page_token = response.get('nextPageToken')
+            if not next_page_token:
+                break
+
+        pages = await asyncio.gather(*tasks)
+
+    save_channel_cache(fetched)
+    stats = [row for page in pages for row in page]
+    return pd.DataFrame(stats, columns=CSV_COLUMNS)
 
 
 class Channel:
     """YouTube channel node"""
-    
+
+    __slots__ = ('name', 'id', 'num_subs', 'category', 'owners', 'icon')
+
     def __init__(self, channel_name="Channel", channel_id="aaa", num_subs=100, 
                  category=None, icon="https://", owners=None):
         self.name = channel_name
@@ -113,75 +262,121 @@ class Channel:
     def addOwner(self, person):
         self.owners.append(person)
 
-    def makeNode(self, graph):
-        graph.add_node(
-            self.id,
-            label=self.name,
-            shape="circularImage",
-            image=self.icon,
-            physics=True,
-            font={"size": 10},
-            group=self.category
-        )
+    def nodeAttrs(self, size):
+        return {
+            'label': self.name,
+            'shape': "circularImage",
+            'image': self.icon,
+            'physics': True,
+            'font': {"size": 10},
+            'group': self.category,
+            'size': size
+        }
 
 
 class Person:
+    __slots__ = ('name', 'channels', 'color', '_channel_ids')
+
     def __init__(self, name="p1", color="red", channels=None):
         self.name = name
         self.channels = []
         self.color = color
+        self._channel_ids = set()
 
     
-    def makeNode(self, graph):
-        graph.add_node(
-            self.name,
-            color={'background': self.color, 'border': self.color},
-            shape="star",
-            physics=True,
-            group="user",
-            size=30,
-            borderWidth=2
-        )
-
-    def generateChannels(self, dataframe, channellist):
+    def nodeAttrs(self):
+        return {
+            'color': {'background': self.color, 'border': self.color},
+            'shape': "star",
+            'physics': True,
+            'group': "user",
+            'size': 30,
+            'borderWidth': 2
+        }
+
+    def generateChannels(self, dataframe, channellist, channel_index):
         """Create channels from CSV data, reusing existing channel objects"""
-        for index, row in dataframe.iterrows():
-            channel_id = row["channel_id"]
+        primary_categories = dataframe["category"].astype("string").fillna("").str.split(",", n=1).str[0]
+
+        for row, category in zip(dataframe.itertuples(index=False), primary_categories):
+            channel_id = row.channel_id
 
             # Check if we've already created this channel
-            existing_channel = next((c for c in channellist if c.id == channel_id), None)
+            existing_channel = channel_index.get(channel_id)
 
             if existing_channel:
                 ch = existing_channel
             else:
                 ch = Channel(
-                    channel_name=row["channel_title"],
+                    channel_name=row.channel_title,
                     channel_id=channel_id,
-                    num_subs=row["subscribers_numeric"],
-                    category=str(row["category"]).split(",")[0],
-                    icon=row['thumbnail']
+                    num_subs=row.subscribers_numeric,
+                    category=category,
+                    icon=row.thumbnail
                 )
+                channel_index[channel_id] = ch
                 channellist.append(ch)
             
-            if ch not in self.channels:
+            # Duplicate rows for a channel neither re-add it nor re-own it
+            if channel_id not in self._channel_ids:
+                self._channel_ids.add(channel_id)
                 self.channels.append(ch)
-            ch.addOwner(self)
+                ch.addOwner(self)
+
+
+def read_user_csv(entry):
+    """Read a user CSV, reusing the parsed DataFrame if the file is unchanged"""
+    mtime = entry.stat().st_mtime
+    cached = _CSV_CACHE.get(entry.path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    df = None
+    if pyarrow is not None:
+        # Multi-threaded parse that skips columns generateChannels doesn't use.
+        # The pyarrow engine has no encoding_errors support, so files with
+        # undecodable bytes fall through to the C engine below
+        try:
+            df = pd.read_csv(entry.path, engine='pyarrow', usecols=CSV_COLUMNS, dtype=CSV_DTYPES,
+                             dtype_backend='pyarrow')
+        except (UnicodeDecodeError, pyarrow.ArrowInvalid):
+            pass
+    if df is None:
+        df = pd.read_csv(entry.path, engine='c', usecols=CSV_COLUMNS, dtype=CSV_DTYPES,
+                         encoding_errors='ignore')
+    # Empty cells in string columns read as pd.NA, which can't be serialized
+    # into the vis-network node data
+    df[['channel_title', 'thumbnail']] = df[['channel_title', 'thumbnail']].fillna('')
+    _CSV_CACHE[entry.path] = (mtime, df)
+    return df
 
 
 def load_users_from_csv(data_dir=DATA_DIR):
     """Load all user CSV files"""
     personlist = []
     channellist = []
+    channel_index = {}
 
     os.makedirs(data_dir, exist_ok=True)
 
-    for entry in os.scandir(data_dir):
-        if entry.is_file() and entry.name.endswith('.csv'):
-            df = pd.read_csv(entry.path, encoding_errors='ignore')
-            user = entry.name.replace(".csv", "")
-            p = Person(user, RandomColor().generate()[0])
-            p.generateChannels(df, channellist)
-            personlist.append(p)
+    user_files = [e for e in os.scandir(data_dir) if e.is_file() and e.name.endswith('.csv')]
+
+    # Evict cached frames for CSVs in this directory that were deleted or renamed
+    live_paths = {e.path for e in user_files}
+    for path in [p for p in _CSV_CACHE if os.path.dirname(p) == data_dir and p not in live_paths]:
+        del _CSV_CACHE[path]
+    palette = RandomColor().generate(count=len(user_files)) if user_files else []
+
+    # Parse in parallel (pandas releases the GIL while parsing), then merge
+    # serially since merging mutates the shared channel list and index
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        dataframes = list(executor.map(read_user_csv, user_files))
+
+    for entry, color, df in zip(user_files, palette, dataframes):
+        user = entry.name.replace(".csv", "")
+        p = Person(user, color)
+        p.generateChannels(df, channellist, channel_index)
+        personlist.append(p)
 
     return personlist, channellist
 
@@ -200,22 +395,36 @@ def build_network_graph(personlist, channellist, display_degree_one=DISPLAY_DEGR
         print("Warning: No valid channels found")
         return nxgraph
 
+    # Scale channel size based on popularity (number of owners)
+    owner_counts = np.fromiter((len(ch.owners) for ch in validlist), dtype=np.int32, count=len(validlist))
+    sizes = ((owner_counts / owner_counts.max()) + 2.0) * 8.0
+
     # Add all nodes
-    for channel in validlist:
-        channel.makeNode(nxgraph)
+    nxgraph.add_nodes_from((ch.id, ch.nodeAttrs(size)) for ch, size in zip(validlist, sizes.tolist()))
+    nxgraph.add_nodes_from((person.name, person.nodeAttrs()) for person in personlist)
+
+    valid_ids = {ch.id for ch in validlist}
+    nxgraph.add_edges_from(
+        (person.name, channel.id, {'color': person.color})
+        for person in personlist
+        for channel in person.channels
+        if channel.id in valid_ids
+    )
 
-    for person in personlist:
-        person.makeNode(nxgraph)
-        for channel in person.channels:
-            if channel in validlist:
-                nxgraph.add_edge(person.name, channel.id, color=person.color)
+    return nxgraph
 
-    # Scale channel size based on popularity (number of owners)
-    max_owners = max(len(channel.owners) for channel in validlist)
-    for channel in validlist:
-        nxgraph.nodes[channel.id]["size"] = ((len(channel.owners) / max_owners) + 2) * 8
 
-    return nxgraph
+def to_vis_data(nxgraph, font_color):
+    """Convert a NetworkX graph to vis-network node and edge dicts in one pass"""
+    nodes = []
+    for node_id, data in nxgraph.nodes(data=True):
+        node = dict(data, id=node_id)
+        node.setdefault('label', node_id)
+        node['font'] = dict(data.get('font', {}), color=font_color)
+        nodes.append(node)
+
+    edges = [dict(data, **{'from': u, 'to': v}) for u, v, data in nxgraph.edges(data=True)]
+    return nodes, edges
 
 
 def create_network_visualization(nxgraph, output_path="static/graph.html"):
@@ -229,25 +438,23 @@ def create_network_visualization(nxgraph, output_path="static/graph.html"):
         font_color="#1D1D1D"
     )
 
-    g.toggle_physics(True)
-    g.barnes_hut(
-        gravity=-50000,      # Negative = repulsion
-        central_gravity=0,
-        spring_length=200,
-        spring_strength=0.1,
-        damping=0.7          # Higher = less movement
-    )
+    # Layout is computed here, so the browser only renders fixed positions
+    compute_layout(nxgraph)
+    g.toggle_physics(False)
     g.show_buttons(filter_=["physics","manipulation"])
     
-    g.from_nx(nxgraph)
-    
-    for node in nxgraph.nodes():
-        if nxgraph.nodes[node].get('group') == 'user':
-            node_data = nxgraph.nodes[node]
-            g.get_node(node)['color'] = node_data.get('color', 'red')
-        
+    # Fill pyvis directly; from_nx re-adds nodes per edge and scans every
+    # existing edge on each add_edge
+    g.nodes, g.edges = to_vis_data(nxgraph, g.font_color)
+    g.node_ids = [node['id'] for node in g.nodes]
+    g.node_map = {node['id']: node for node in g.nodes}
+
     g.save_graph(output_path)
 
+    # Precompress once so the web app can send it with Content-Encoding: gzip
+    with open(output_path, 'rb') as f_in, gzip.open(output_path + '.gz', 'wb', compresslevel=6) as f_out:
+        shutil.copyfileobj(f_in, f_out)
+
     return output_path
 
 
@@ -263,7 +470,7 @@ def fetch_user_subscriptions():
     print(f"✓ Found {len(df)} subscriptions")
 
     # Save to CSV with sanitized filename
-    safe_username = re.sub(r'[^\w\s-]', '', username).strip().replace(' ', '_')
+    safe_username = _SAFE_USERNAME_RE.sub('', username).strip().replace(' ', '_')
     os.makedirs(DATA_DIR, exist_ok=True)
     filename = f'{DATA_DIR}/{safe_username}.csv'
     df.to_csv(filename, index=False)
@@ -285,7 +492,7 @@ def generate_visualization():
     
     return graph_path
 
-if __name__ == "main":
+if __name__ == "__main__":
     import sys
         
     if len(sys.argv) > 1 and sys.argv[1] == "fetch":